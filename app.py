@@ -1,17 +1,36 @@
-from flask import Flask, request, jsonify, Response, stream_with_context
-from anthropic import AnthropicVertex
-from google.auth.transport.requests import Request
-from google.oauth2 import service_account
-import json
+from fastapi import FastAPI, Request as HTTPRequest
+from fastapi.responses import Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+from anthropic import (
+    APIError,
+    APIStatusError,
+    AsyncAnthropicVertex,
+    AsyncStream,
+    DefaultAsyncHttpxClient,
+    DEFAULT_CONNECTION_LIMITS,
+    DEFAULT_TIMEOUT,
+)
+from anthropic.types import Message, RawMessageStreamEvent
+from client import get_vertex_client, get_vertex_credentials, refresh_vertex_credentials, release_vertex_client
+import asyncio
+import orjson
 import os
+import gzip
+import shutil
+import sys
 import logging
-from logging.handlers import RotatingFileHandler
-from typing import Optional, Dict, Any, Iterator
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import queue
+from typing import Optional, Dict, Any, AsyncGenerator
 from dotenv import load_dotenv
 from functools import wraps
-import uuid
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import itertools
 from contextvars import ContextVar
 import time
+from datetime import datetime, timezone
+import uvicorn
 
 # Create a context variable for request_id
 request_id_var = ContextVar('request_id', default='main')
@@ -21,7 +40,15 @@ class RequestIdFilter(logging.Filter):
         record.request_id = request_id_var.get()
         return True
 
+load_dotenv()
+
 # Set up logging
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+WORKERS = int(os.getenv('WORKERS', 1))
+
+# With several worker processes each one rotates its own file, so they never rename a file another has open
+LOG_FILE = 'logs/flask_app.log' if WORKERS == 1 else f'logs/flask_app.{os.getpid()}.log'
+
 log_formatter = logging.Formatter(
     '%(asctime)s [%(levelname)s] [%(request_id)s] %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S'
@@ -31,64 +58,85 @@ log_formatter = logging.Formatter(
 if not os.path.exists('logs'):
     os.makedirs('logs')
 
+# Rotated log files are gzip-compressed to keep total disk usage bounded
+def gzip_namer(name: str) -> str:
+    return name + '.gz'
+
+def gzip_rotator(source: str, dest: str) -> None:
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
 # File handler with rotation
 file_handler = RotatingFileHandler(
-    'logs/flask_app.log',
-    maxBytes=10*1024*1024,  # 10MB
-    backupCount=5
+    LOG_FILE,
+    maxBytes=100*1024*1024,  # 100MB
+    backupCount=10
 )
+file_handler.namer = gzip_namer
+file_handler.rotator = gzip_rotator
 file_handler.setFormatter(log_formatter)
-file_handler.setLevel(logging.DEBUG)
-file_handler.addFilter(RequestIdFilter())
+file_handler.setLevel(LOG_LEVEL)
 
 # Console handler
 console_handler = logging.StreamHandler()
 console_handler.setFormatter(log_formatter)
 console_handler.setLevel(logging.DEBUG)
-console_handler.addFilter(RequestIdFilter())
+
+# Request handlers only enqueue records; a background thread does the actual I/O.
+# The request ID is stamped at enqueue time, while the context variable is still set.
+log_queue = queue.SimpleQueue()
+queue_handler = QueueHandler(log_queue)
+queue_handler.addFilter(RequestIdFilter())
+log_listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+log_listener.start()
 
 # Setup root logger
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(queue_handler)
+
+# Generated IDs are <pid>-<counter>, so concurrent workers never hand out the same ID;
+# the counter starts at the start time to make repeats after a restart unlikely
+request_counter = itertools.count(int(time.time()))
+REQUEST_ID_PREFIX = f"{os.getpid():x}-"
+# Caller-supplied IDs go into every log line, so cap their length
+MAX_REQUEST_ID_LENGTH = 64
 
 def log_request(f):
     @wraps(f)
-    def decorated_function(*args, **kwargs):
-        # Generate and set request ID for this context
-        req_id = str(uuid.uuid4())[:8]
+    async def decorated_function(*args, **kwargs):
+        request: HTTPRequest = kwargs['request']
+        headers = request.headers
+        # Reuse the caller's request ID for tracing, otherwise take the next counter value
+        req_id = headers.get('x-request-id', '')[:MAX_REQUEST_ID_LENGTH] or f"{REQUEST_ID_PREFIX}{next(request_counter):x}"
         token = request_id_var.set(req_id)
         
         try:
-            # Log request details
-            logger.info("\n%s\nRequest Details:", "="*50)
-            logger.info(f"Endpoint: {request.endpoint}")
-            logger.info(f"Method: {request.method}")
-            logger.info(f"URL: {request.url}")
-            logger.info(f"Headers:\n{dict(request.headers)}")
+            # Log request details as a single record
+            snapshot = {
+                "endpoint": f.__name__,
+                "method": request.method,
+                "path": request.url.path,
+                "len": headers.get('content-length'),
+            }
+            logger.info("Request: %s", snapshot)
             
-            # Log request data based on content type
-            if request.is_json:
-                logger.info(f"JSON Data:\n{json.dumps(request.json, indent=2)}")
-            elif request.form:
-                logger.info(f"Form Data: {dict(request.form)}")
-            elif request.data:
-                logger.info(f"Raw Data: {request.data.decode()}")
-                
-            logger.info(f"Query Parameters: {dict(request.args)}")
-            logger.info(f"{'='*50}\n")
+            # Headers, query and body can be large, so only serialize them when they will be emitted
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Headers: %s", dict(headers))
+                logger.debug("Query Parameters: %s", dict(request.query_params))
+                # Logged as received; a malformed body is reported by the handler, not here
+                body = await request.body()
+                if body:
+                    logger.debug("Request Data: %s", body.decode(errors='replace'))
             
-            return f(*args, **kwargs)
+            return await f(*args, **kwargs)
         finally:
             request_id_var.reset(token)
             
     return decorated_function
 
-load_dotenv()
-
-app = Flask(__name__)
-
 # Load configuration from environment
 PORT = int(os.getenv('PORT', 3456))
 PROJECT_ID = os.getenv('PROJECT_ID', 'meta-agents')
@@ -97,12 +145,124 @@ MODEL = os.getenv('CLAUDE_MODEL', 'claude-3-7-sonnet@20250219')
 HAIKU_MODEL = os.getenv('CLAUDE_HAIKU_MODEL', 'claude-3-5-haiku@20241022')
 
 # Map of supported models
-SUPPORTED_MODELS = {
+SUPPORTED_MODELS = {sys.intern(k): sys.intern(v) for k, v in {
     'claude-3-sonnet-20240229': MODEL,
     'claude-3-7-sonnet-20250219': MODEL,
     'claude-3-haiku-20240307': HAIKU_MODEL,
     'claude-3-5-haiku-20241022': HAIKU_MODEL
-}
+}.items()}
+
+# JSON bodies are encoded with orjson and returned as plain bytes
+def json_response(content: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(orjson.dumps(content), status_code=status_code, headers=headers, media_type='application/json')
+
+# Server-sent event framing; Vertex stream events are forwarded as-is, as bytes that go straight to the socket
+def sse_frame(event: RawMessageStreamEvent) -> bytes:
+    return b"event: " + event.type.encode() + b"\ndata: " + event.model_dump_json(exclude_unset=True).encode() + b"\n\n"
+
+def error_frame(error: Exception) -> bytes:
+    # Terminal error event in the Messages API shape, reusing the upstream error body when there is one
+    body = getattr(error, 'body', None)
+    if isinstance(body, dict) and isinstance(body.get('error'), dict):
+        detail = body['error']
+    else:
+        detail = {"type": "api_error", "message": str(error)}
+    return b"event: error\ndata: " + orjson.dumps({"type": "error", "error": detail}) + b"\n\n"
+
+# Frames arriving within this window of the first buffered one are sent in a single write
+STREAM_COALESCE_INTERVAL = 0.008
+STREAM_COALESCE_MAX_BYTES = 4096
+
+async def coalesce_frames(frames: AsyncGenerator[bytes, None]) -> AsyncGenerator[bytes, None]:
+    loop = asyncio.get_running_loop()
+    iterator = frames.__aiter__()
+    pending: Optional[asyncio.Future] = None
+    buffer = []
+    size = 0
+    deadline = 0.0
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            if buffer:
+                # Wait for the next frame only until the buffered ones are due
+                done, _ = await asyncio.wait({pending}, timeout=max(deadline - loop.time(), 0))
+                if not done:
+                    yield b"".join(buffer)
+                    buffer, size = [], 0
+                    continue
+            try:
+                frame = await pending
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # Frames the source already produced still go out before its error propagates
+                if buffer:
+                    yield b"".join(buffer)
+                    buffer, size = [], 0
+                raise
+            finally:
+                pending = None
+            if not buffer:
+                deadline = loop.time() + STREAM_COALESCE_INTERVAL
+            buffer.append(frame)
+            size += len(frame)
+            if size >= STREAM_COALESCE_MAX_BYTES or loop.time() >= deadline:
+                yield b"".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield b"".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        # Close the source as well, so an abandoned stream releases its Vertex connection
+        await iterator.aclose()
+
+class EventStreamResponse(StreamingResponse):
+    # Frames are already-encoded bytes, so each one is handed to the ASGI server as a
+    # single body message, without StreamingResponse's per-chunk encode and task group
+    media_type = 'text/event-stream'
+
+    def __init__(self, content: AsyncGenerator[bytes, None], request_id: str, **kwargs):
+        super().__init__(content, **kwargs)
+        self.request_id = request_id
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # The body is sent after the handler (and log_request) has returned, so restore the
+        # request ID here; tasks started while iterating the body copy it from this context
+        token = request_id_var.set(self.request_id)
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        disconnected = asyncio.ensure_future(self._wait_for_disconnect(receive))
+        try:
+            async for frame in self.body_iterator:
+                # Stop pulling from Vertex once the client has gone away
+                if disconnected.done():
+                    break
+                await send({'type': 'http.response.body', 'body': frame, 'more_body': True})
+            else:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            disconnected.cancel()
+            await self.body_iterator.aclose()
+            request_id_var.reset(token)
+        if self.background is not None:
+            await self.background()
+
+    @staticmethod
+    async def _wait_for_disconnect(receive: Receive) -> None:
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+# HTTP/2 lets concurrent requests to Vertex share a connection instead of one each.
+# Limits and timeout are built from the SDK's own defaults so their types match the
+# httpx package the SDK uses (newer releases ship on httpx2)
+VERTEX_HTTP_LIMITS = type(DEFAULT_CONNECTION_LIMITS)(max_connections=256, max_keepalive_connections=128)
+VERTEX_HTTP_TIMEOUT = DEFAULT_TIMEOUT
+
+# Refresh the Vertex access token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 5 * 60
+TOKEN_REFRESH_RETRY = 30
 
 class VertexClaudeClient:
     def __init__(
@@ -116,44 +276,82 @@ class VertexClaudeClient:
         self.location = location
         self.model = model or MODEL
         self.service_account_file = service_account_file
+        self._credentials = get_vertex_credentials(self.service_account_file)
+        self._refresh_task: Optional[asyncio.Task] = None
+        # google-auth's token refresh is blocking, so it runs on its own thread off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='vertex-auth')
         self.client = self._initialize_client()
         self.tools = []
 
-    def _initialize_client(self) -> AnthropicVertex:
+    def _initialize_client(self) -> AsyncAnthropicVertex:
         logger.info(f"Initializing Vertex AI client with project_id={self.project_id}, location={self.location}")
-        credentials = service_account.Credentials.from_service_account_file(
+        return get_vertex_client(
+            self.project_id,
+            self.location,
             self.service_account_file,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"]
-        )
-        credentials.refresh(Request())
-        return AnthropicVertex(
-            region=self.location,
-            project_id=self.project_id,
-            access_token=credentials.token
+            client_class=AsyncAnthropicVertex,
+            http_client_factory=lambda: DefaultAsyncHttpxClient(
+                http2=True,
+                limits=VERTEX_HTTP_LIMITS,
+                timeout=VERTEX_HTTP_TIMEOUT
+            )
         )
 
     def refresh_token(self) -> None:
         logger.info("Refreshing Vertex AI token")
-        self.client = self._initialize_client()
+        # The shared client picks up the new token in place and keeps its connection pool
+        refresh_vertex_credentials(self.service_account_file)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            expiry = self._credentials.expiry
+            if expiry is None:
+                delay = TOKEN_REFRESH_MARGIN
+            else:
+                # google-auth reports expiry as a naive UTC datetime
+                delay = (expiry - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds() - TOKEN_REFRESH_MARGIN
+            await asyncio.sleep(max(delay, 0))
+            try:
+                await asyncio.get_running_loop().run_in_executor(self._executor, self.refresh_token)
+            except Exception as e:
+                logger.error(f"Error refreshing Vertex AI token: {str(e)}", exc_info=True)
+                await asyncio.sleep(TOKEN_REFRESH_RETRY)
+
+    def start_token_refresh(self) -> None:
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def aclose(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        client = release_vertex_client(
+            self.project_id,
+            self.location,
+            self.service_account_file,
+            client_class=AsyncAnthropicVertex
+        )
+        if client is not None:
+            await client.close()
+        self._executor.shutdown(wait=False)
 
     def add_tools(self, tools: list) -> None:
         logger.info(f"Adding tools: {tools}")
         self.tools = tools
 
-    def create_message(
+    def _build_kwargs(
         self,
         prompt: str,
-        max_tokens: int = 1024,
-        system_prompt: Optional[str] = None,
-        stream: bool = False,
-        **kwargs
+        max_tokens: int,
+        system_prompt: Optional[str],
+        extra: Dict[str, Any]
     ) -> Dict[str, Any]:
         logger.info(f"Creating message with prompt: {prompt[:100]}...")
         kwargs = {
             "max_tokens": max_tokens,
             "messages": [{"role": "user", "content": prompt}],
             "model": self.model,
-            **{k: v for k, v in kwargs.items() if k not in ['messages', 'system']}
+            **{k: v for k, v in extra.items() if k not in ['messages', 'system']}
         }
         if system_prompt:
             kwargs["system"] = system_prompt
@@ -161,145 +359,117 @@ class VertexClaudeClient:
         if self.tools:
             kwargs["tools"] = self.tools
             logger.info(f"Using tools: {self.tools}")
-        
-        if stream:
-            logger.info("Using streaming mode")
-            return self.client.messages.stream(**kwargs)
-        
+        return kwargs
+
+    async def create_message(
+        self,
+        prompt: str,
+        max_tokens: int = 1024,
+        system_prompt: Optional[str] = None,
+        **kwargs
+    ) -> Message:
+        kwargs = self._build_kwargs(prompt, max_tokens, system_prompt, kwargs)
         logger.info("Using non-streaming mode")
-        return self.client.messages.create(**kwargs)
+        return await self.client.messages.create(**kwargs)
+
+    async def stream_message(
+        self,
+        prompt: str,
+        max_tokens: int = 1024,
+        system_prompt: Optional[str] = None,
+        **kwargs
+    ) -> AsyncStream[RawMessageStreamEvent]:
+        kwargs = self._build_kwargs(prompt, max_tokens, system_prompt, kwargs)
+        logger.info("Using streaming mode")
+        # Raw events, not the MessageStream helper, so they can be forwarded without re-synthesizing
+        return await self.client.messages.create(stream=True, **kwargs)
 
-# Initialize the Claude client with default values
-claude_client = VertexClaudeClient()
+# The Claude client is created at startup rather than import, so a process that only
+# imports this module (e.g. the parent of multiple workers) never fetches credentials
+claude_client: Optional[VertexClaudeClient] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global claude_client
+    # Initialize the Claude client with default values
+    claude_client = VertexClaudeClient()
+    claude_client.start_token_refresh()
+    try:
+        yield
+    finally:
+        await claude_client.aclose()
+        log_listener.stop()
 
-@app.route('/v1/messages', methods=['POST'])
+app = FastAPI(lifespan=lifespan)
+
+@app.post('/v1/messages')
 @log_request
-def create_message():
+async def create_message(request: HTTPRequest):
     try:
-        data = request.json
-        logger.info(f"Processing request data: {json.dumps(data, indent=2)}")
+        data = orjson.loads(await request.body())
         
         # Validate required fields
         if not data:
-            return jsonify({'error': 'No JSON data provided'}), 400
+            return json_response({'error': 'No JSON data provided'}, status_code=400)
             
         # Handle model selection
         requested_model = data.get('model')
-        if requested_model in SUPPORTED_MODELS:
-            data['model'] = SUPPORTED_MODELS[requested_model]
-            logger.info(f"Using mapped model: {data['model']} for requested model: {requested_model}")
-        else:
-            logger.warning(f"Requested model '{requested_model}' not in supported models. Using default model '{MODEL}'.")
-            data['model'] = MODEL
+        model = SUPPORTED_MODELS.get(requested_model)
+        if model is None:
+            if requested_model is not None:
+                logger.warning("Requested model '%s' not in supported models. Using default model '%s'.", requested_model, MODEL)
+            model = MODEL
+        data['model'] = model
             
         stream = data.get('stream', False)
         
         # Extract message content from the messages array
         messages = data.get('messages', [])
         if not messages:
-            return jsonify({'error': 'No messages provided'}), 400
+            return json_response({'error': 'No messages provided'}, status_code=400)
         
         # Normalize message content format
-        first_message = messages[0]
-        if isinstance(first_message.get('content'), str):
-            content = first_message['content']
-        elif isinstance(first_message.get('content'), list):
-            # Extract text from content array
-            content = ' '.join(item['text'] for item in first_message['content'] if item.get('type') == 'text')
+        first_content = messages[0].get('content')
+        if isinstance(first_content, str):
+            content = first_content
+        elif isinstance(first_content, list):
+            # Extract text from content array; a single text block is used as-is
+            texts = [block['text'] for block in first_content if isinstance(block, dict) and block.get('type') == 'text']
+            content = texts[0] if len(texts) == 1 else ' '.join(texts)
         else:
-            return jsonify({'error': 'Invalid message content format'}), 400
+            return json_response({'error': 'Invalid message content format'}, status_code=400)
         
         # Remove fields that are handled separately
         kwargs = {k: v for k, v in data.items() if k not in ['messages', 'system', 'stream']}
         
         if stream:
             logger.info("Processing streaming request")
-            def generate():
-                message_id = f"msg_{int(time.time() * 1000)}"
-                content_block_index = 0
-                
-                # Send message_start event
-                message_start = {
-                    "type": "message_start",
-                    "message": {
-                        "id": message_id,
-                        "type": "message",
-                        "role": "assistant",
-                        "content": [],
-                        "model": MODEL,
-                        "stop_reason": None,
-                        "stop_sequence": None,
-                        "usage": {"input_tokens": 1, "output_tokens": 1}
-                    }
-                }
-                yield f"event: message_start\ndata: {json.dumps(message_start)}\n\n"
-                
-                # Send content_block_start event
-                block_start = {
-                    "type": "content_block_start",
-                    "index": content_block_index,
-                    "content_block": {
-                        "type": "text",
-                        "text": ""
-                    }
-                }
-                yield f"event: content_block_start\ndata: {json.dumps(block_start)}\n\n"
-                
-                # Stream the content
-                stream_manager = claude_client.create_message(
-                    prompt=content,
-                    system_prompt=data.get('system'),
-                    stream=True,
-                    **kwargs
-                )
-                
-                accumulated_text = ""
-                with stream_manager as stream:
-                    for chunk in stream.text_stream:
-                        # Send content delta
-                        delta = {
-                            "type": "content_block_delta",
-                            "index": content_block_index,
-                            "delta": {
-                                "type": "text_delta",
-                                "text": chunk
-                            }
-                        }
-                        accumulated_text += chunk
-                        logger.debug(f"Streaming chunk: {delta}")
-                        yield f"event: content_block_delta\ndata: {json.dumps(delta)}\n\n"
-                
-                # Send content_block_stop event
-                block_stop = {
-                    "type": "content_block_stop",
-                    "index": content_block_index
-                }
-                yield f"event: content_block_stop\ndata: {json.dumps(block_stop)}\n\n"
-                
-                # Send message_delta event
-                message_delta = {
-                    "type": "message_delta",
-                    "delta": {
-                        "stop_reason": "end_turn",
-                        "stop_sequence": None,
-                        "content": [{
-                            "type": "text",
-                            "text": accumulated_text
-                        }]
-                    },
-                    "usage": {"input_tokens": 100, "output_tokens": 150}
-                }
-                yield f"event: message_delta\ndata: {json.dumps(message_delta)}\n\n"
-                
-                # Send message_stop event
-                message_stop = {
-                    "type": "message_stop"
-                }
-                yield f"event: message_stop\ndata: {json.dumps(message_stop)}\n\n"
+            # Open the stream before responding, so a Vertex error (400, 429, ...) is returned
+            # with its own status instead of as an empty 200 event stream
+            event_stream = await claude_client.stream_message(
+                prompt=content,
+                system_prompt=data.get('system'),
+                **kwargs
+            )
+
+            async def generate():
+                try:
+                    async with event_stream:
+                        async for event in event_stream:
+                            if logger.isEnabledFor(logging.DEBUG):
+                                logger.debug("Streaming event type=%s", event.type)
+                            yield sse_frame(event)
+                except APIError as e:
+                    # e.g. an `event: error` frame from Vertex (overloaded_error); pass it on so clients can retry
+                    logger.error(f"Vertex AI stream failed: {str(e)}")
+                    yield error_frame(e)
+                except Exception as e:
+                    logger.error(f"Error streaming response: {str(e)}", exc_info=True)
+                    yield error_frame(e)
             
-            return Response(
-                stream_with_context(generate()),
-                mimetype='text/event-stream',
+            return EventStreamResponse(
+                coalesce_frames(generate()),
+                request_id=request_id_var.get(),
                 headers={
                     'Cache-Control': 'no-cache',
                     'Connection': 'keep-alive',
@@ -307,42 +477,49 @@ def create_message():
             )
         
         logger.info("Processing non-streaming request")
-        message = claude_client.create_message(
+        message = await claude_client.create_message(
             prompt=content,
             system_prompt=data.get('system'),
             **kwargs
         )
         
-        # Convert Message object to JSON-serializable format
-        response = {
-            'id': message.id,
-            'content': [{'type': block.type, 'text': block.text} for block in message.content],
-            'model': message.model,
-            'role': message.role,
-            'stop_reason': message.stop_reason,
-            'stop_sequence': message.stop_sequence,
-            'type': message.type,
-            'usage': {
-                'input_tokens': message.usage.input_tokens,
-                'output_tokens': message.usage.output_tokens,
-                'cache_creation_input_tokens': message.usage.cache_creation_input_tokens,
-                'cache_read_input_tokens': message.usage.cache_read_input_tokens
-            }
-        }
+        # The SDK model already has the Messages API shape, including non-text blocks;
+        # only the fields Vertex sent are kept, as on the streaming path
+        response = message.model_dump(mode='json', exclude_unset=True)
         
-        logger.info(f"Sending response: {json.dumps(response, indent=2)}")
-        return jsonify(response)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Response id=%s tokens_out=%s", response['id'], response['usage']['output_tokens'])
+        return json_response(response)
+    
+    except APIStatusError as e:
+        # Pass Vertex errors through with their status so clients can act on them (e.g. retry a 429)
+        logger.error(f"Vertex AI returned {e.status_code}: {str(e)}")
+        headers = {}
+        if 'retry-after' in e.response.headers:
+            headers['Retry-After'] = e.response.headers['retry-after']
+        body = e.body if isinstance(e.body, dict) else {'error': str(e)}
+        return json_response(body, status_code=e.status_code, headers=headers)
     
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}", exc_info=True)
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, status_code=500)
 
-@app.route('/health', methods=['GET'])
+@app.get('/health')
 @log_request
-def health_check():
+async def health_check(request: HTTPRequest):
     logger.info("Health check request received")
-    return jsonify({'status': 'healthy'})
+    return json_response({'status': 'healthy'})
 
 if __name__ == '__main__':
     logger.info(f"Starting server on port {PORT}")
-    app.run(host='0.0.0.0', port=PORT) 
\ No newline at end of file
+    # Under `python app.py` this module is __main__, so pass the app object directly;
+    # an import string would import it a second time as `app`. Workers need the import string.
+    uvicorn.run(
+        app if WORKERS == 1 else 'app:app',
+        host='0.0.0.0',
+        port=PORT,
+        workers=WORKERS,
+        loop='auto',
+        http='httptools'
+    )
+ 
\ No newline at end of file
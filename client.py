@@ -2,9 +2,75 @@
 from anthropic import AnthropicVertex
 from google.auth.transport.requests import Request
 from google.oauth2 import service_account
-from typing import List, Optional, Any, Dict, Iterator
+from typing import List, Optional, Any, Callable, Dict, Iterator, Tuple
+import threading
 
-# ClaudeClient (unchanged from your original)
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+# Credentials and Vertex clients are shared by everything in the process, so each
+# service account is parsed and refreshed once and each client keeps one connection pool
+_credentials_cache: Dict[str, service_account.Credentials] = {}
+_client_cache: Dict[Tuple[type, str, str, str], Any] = {}
+_cache_lock = threading.RLock()
+
+def get_vertex_credentials(service_account_file: str) -> service_account.Credentials:
+    with _cache_lock:
+        credentials = _credentials_cache.get(service_account_file)
+        if credentials is None:
+            credentials = service_account.Credentials.from_service_account_file(
+                service_account_file,
+                scopes=SCOPES
+            )
+            credentials.refresh(Request())
+            _credentials_cache[service_account_file] = credentials
+        return credentials
+
+def get_vertex_client(
+    project_id: str,
+    location: str,
+    service_account_file: str,
+    client_class: type = AnthropicVertex,
+    http_client_factory: Optional[Callable[[], Any]] = None
+):
+    key = (client_class, project_id, location, service_account_file)
+    with _cache_lock:
+        client = _client_cache.get(key)
+        if client is None:
+            credentials = get_vertex_credentials(service_account_file)
+            # The HTTP client is only built on a cache miss, so a cache hit never leaves one unclosed
+            client_kwargs = {}
+            if http_client_factory is not None:
+                client_kwargs["http_client"] = http_client_factory()
+            client = client_class(
+                region=location,
+                project_id=project_id,
+                access_token=credentials.token,
+                **client_kwargs
+            )
+            _client_cache[key] = client
+        return client
+
+def release_vertex_client(
+    project_id: str,
+    location: str,
+    service_account_file: str,
+    client_class: type = AnthropicVertex
+):
+    # Drop the client from the cache before the caller closes it, so it is never handed out closed
+    with _cache_lock:
+        return _client_cache.pop((client_class, project_id, location, service_account_file), None)
+
+def refresh_vertex_credentials(service_account_file: str) -> service_account.Credentials:
+    with _cache_lock:
+        credentials = get_vertex_credentials(service_account_file)
+        credentials.refresh(Request())
+        # Update the cached clients in place so they keep their connection pools
+        for (_, _, _, client_file), client in _client_cache.items():
+            if client_file == service_account_file:
+                client.access_token = credentials.token
+        return credentials
+
+# ClaudeClient: synchronous client sharing the cached Vertex credentials and clients above
 class ClaudeClient:
     def __init__(
         self,
@@ -21,19 +87,10 @@ class ClaudeClient:
         self.tools = []
 
     def _initialize_client(self) -> AnthropicVertex:
-        credentials = service_account.Credentials.from_service_account_file(
-            self.service_account_file,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"]
-        )
-        credentials.refresh(Request())
-        return AnthropicVertex(
-            region=self.location,
-            project_id=self.project_id,
-            access_token=credentials.token
-        )
+        return get_vertex_client(self.project_id, self.location, self.service_account_file)
 
     def refresh_token(self) -> None:
-        self.client = self._initialize_client()
+        refresh_vertex_credentials(self.service_account_file)
 
     def add_tools(self, tools: List[Dict[str, Any]]) -> None:
         self.tools = tools
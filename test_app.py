@@ -0,0 +1,241 @@
+import asyncio
+import importlib
+import json
+
+from anthropic import AsyncAnthropicVertex, DefaultAsyncHttpxClient
+from fastapi.testclient import TestClient
+
+import app
+from app import EventStreamResponse, VertexClaudeClient, coalesce_frames
+
+# The httpx package the SDK is built on (httpx2 in newer releases)
+httpx = importlib.import_module(DefaultAsyncHttpxClient.__mro__[1].__module__.split(".")[0])
+
+MESSAGE = {
+    "id": "msg_1",
+    "type": "message",
+    "role": "assistant",
+    "model": "claude-3-7-sonnet@20250219",
+    "content": [{"type": "text", "text": "Hello"}],
+    "stop_reason": "end_turn",
+    "stop_sequence": None,
+    "usage": {"input_tokens": 3, "output_tokens": 1},
+}
+
+
+def use_vertex_transport(monkeypatch, handler):
+    # A real VertexClaudeClient whose SDK client talks to a mocked Vertex endpoint
+    claude_client = VertexClaudeClient.__new__(VertexClaudeClient)
+    claude_client.model = app.MODEL
+    claude_client.tools = []
+    claude_client.client = AsyncAnthropicVertex(
+        region="us-east5",
+        project_id="test-project",
+        access_token="test-token",
+        http_client=DefaultAsyncHttpxClient(transport=httpx.MockTransport(handler)),
+    )
+    monkeypatch.setattr(app, "claude_client", claude_client)
+    return TestClient(app.app)
+
+
+async def collect(frames):
+    received = []
+    try:
+        async for frame in frames:
+            received.append(frame)
+    except Exception as e:
+        return received, e
+    return received, None
+
+
+def test_coalesce_frames_merges_frames_within_interval():
+    async def source():
+        yield b"a;"
+        yield b"b;"
+        yield b"c;"
+
+    received, error = asyncio.run(collect(coalesce_frames(source())))
+    assert error is None
+    assert b"".join(received) == b"a;b;c;"
+    assert len(received) == 1
+
+
+def test_coalesce_frames_flushes_buffer_before_error():
+    async def source():
+        yield b"a;"
+        yield b"b;"
+        raise RuntimeError("upstream failed")
+
+    received, error = asyncio.run(collect(coalesce_frames(source())))
+    assert b"".join(received) == b"a;b;"
+    assert isinstance(error, RuntimeError)
+
+
+def test_coalesce_frames_closes_source_when_closed_early():
+    closed = []
+
+    async def source():
+        try:
+            yield b"a;"
+            await asyncio.sleep(1)
+            yield b"b;"
+        finally:
+            closed.append(True)
+
+    async def run():
+        frames = coalesce_frames(source())
+        first = await frames.__anext__()
+        await frames.aclose()
+        return first
+
+    assert asyncio.run(run()) == b"a;"
+    assert closed == [True]
+
+
+def test_event_stream_response_stops_on_disconnect():
+    closed = []
+    produced = []
+
+    async def source():
+        try:
+            for i in range(100):
+                produced.append(i)
+                yield b"frame;"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.append(True)
+
+    async def run():
+        sent = []
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if message['type'] == 'http.response.body' and len(sent) == 3:
+                disconnect.set()
+
+        response = EventStreamResponse(source(), request_id='test')
+        await response({'type': 'http'}, receive, send)
+        return sent
+
+    sent = asyncio.run(run())
+    assert sent[0]['type'] == 'http.response.start'
+    assert all(message.get('more_body', True) for message in sent[1:])
+    assert len(produced) < 100
+    assert closed == [True]
+
+
+def test_event_stream_response_ends_body_when_source_is_done():
+    async def source():
+        yield b"a;"
+
+    async def run():
+        sent = []
+
+        async def receive():
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        await EventStreamResponse(source(), request_id='test')({'type': 'http'}, receive, send)
+        return sent
+
+    sent = asyncio.run(run())
+    assert sent[1] == {'type': 'http.response.body', 'body': b"a;", 'more_body': True}
+    assert sent[-1] == {'type': 'http.response.body', 'body': b'', 'more_body': False}
+
+
+def test_non_streaming_reply_forwards_only_vertex_fields(monkeypatch):
+    client = use_vertex_transport(monkeypatch, lambda request: httpx.Response(200, json=MESSAGE))
+
+    response = client.post("/v1/messages", json={
+        "model": "claude-3-7-sonnet-20250219",
+        "max_tokens": 16,
+        "messages": [{"role": "user", "content": "Hi"}],
+    })
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == MESSAGE
+
+
+
+def request_ids_for(monkeypatch, *headers):
+    client = TestClient(app.app)
+    seen = []
+    monkeypatch.setattr(app.logger, "info", lambda *args: seen.append(app.request_id_var.get()))
+    for header in headers:
+        seen.clear()
+        client.get("/health", headers=header)
+        yield seen[0]
+
+
+def test_request_id_header_is_truncated(monkeypatch):
+    [request_id] = request_ids_for(monkeypatch, {"x-request-id": "x" * 500})
+    assert request_id == "x" * app.MAX_REQUEST_ID_LENGTH
+
+
+def test_generated_request_ids_include_pid(monkeypatch):
+    first, second = request_ids_for(monkeypatch, {}, {})
+    assert first.startswith(app.REQUEST_ID_PREFIX)
+    assert second.startswith(app.REQUEST_ID_PREFIX)
+    assert first != second
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+STREAM_REQUEST = {
+    "model": "claude-3-7-sonnet-20250219",
+    "max_tokens": 16,
+    "stream": True,
+    "messages": [{"role": "user", "content": "Hi"}],
+}
+
+
+def test_streaming_forwards_mid_stream_vertex_error(monkeypatch):
+    delta = {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "Hel"}}
+    overloaded = {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}}
+    body = "".join([
+        sse("message_start", {"type": "message_start", "message": {**MESSAGE, "content": [], "stop_reason": None}}),
+        sse("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}),
+        sse("content_block_delta", delta),
+        sse("content_block_delta", delta),
+        sse("error", overloaded),
+    ])
+    client = use_vertex_transport(monkeypatch, lambda request: httpx.Response(
+        200, content=body.encode(), headers={"content-type": "text/event-stream"}
+    ))
+
+    response = client.post("/v1/messages", json=STREAM_REQUEST)
+
+    assert response.status_code == 200
+    events = [frame.split("\n", 1)[0] for frame in response.text.strip().split("\n\n")]
+    assert events == [
+        "event: message_start",
+        "event: content_block_start",
+        "event: content_block_delta",
+        "event: content_block_delta",
+        "event: error",
+    ]
+    assert response.text.strip().endswith("data: " + json.dumps(overloaded, separators=(",", ":")))
+
+
+def test_streaming_returns_vertex_status_before_stream_opens(monkeypatch):
+    error = {"type": "error", "error": {"type": "rate_limit_error", "message": "Slow down"}}
+    client = use_vertex_transport(monkeypatch, lambda request: httpx.Response(
+        429, json=error, headers={"retry-after": "7"}
+    ))
+    monkeypatch.setattr(app.claude_client.client, "max_retries", 0)
+
+    response = client.post("/v1/messages", json=STREAM_REQUEST)
+
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "7"
+    assert response.json() == error